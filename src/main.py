@@ -1,12 +1,16 @@
+from __future__ import annotations
+
 import argparse
 import cbor2
+import functools
 import os
+import sys
+import tempfile
+import time
 import wallet        as w
 
-from datetime        import datetime
-from lib.chain_query import ChainQuery
-from mint            import Mint
-from swap            import SwapContract, Swap
+from swap            import SwapContract, Swap, invalidate_utxo_cache
+from typing          import TYPE_CHECKING
 
 from pycardano import (
     Address,
@@ -16,40 +20,92 @@ from pycardano import (
     plutus_script_hash,
 )
 
+if TYPE_CHECKING:
+    from lib.chain_query import ChainQuery
+
 # Environment's settings
 BLOCKFROST_PROJECT_ID = os.environ.get('BLOCKFROST_PROJECT_ID')
 BLOCKFROST_BASE_URL = os.environ.get('BLOCFROST_BASE_URL')
 
 NETWORK_MODE = Network.TESTNET
 
-# Charli3's oracle contract address
-oracle_address = Address.from_primitive(
-    "addr_test1wz58xs5ygmjf9a3p6y3qzmwxp7cyj09zk90rweazvj8vwds4d703u"
-)
 
-# Custom contract address (swap contract)
-swap_address = Address.from_primitive(
-    "addr_test1wrcraeyfdkurcz286jaq02hdj5krntc47074vky5j8suhpqew37jy"
-)
+# Charli3's oracle contract address and custom contract address (swap contract)
+@functools.cache
+def _addresses() -> tuple[Address, Address]:
+    oracle_address = Address.from_primitive(
+        "addr_test1wz58xs5ygmjf9a3p6y3qzmwxp7cyj09zk90rweazvj8vwds4d703u"
+    )
+    swap_address = Address.from_primitive(
+        "addr_test1wrcraeyfdkurcz286jaq02hdj5krntc47074vky5j8suhpqew37jy"
+    )
+    return oracle_address, swap_address
+
 
 # Blockfrost's settings
-context = ChainQuery(
-    BLOCKFROST_PROJECT_ID,
-    NETWORK_MODE,
-    base_url=BLOCKFROST_BASE_URL
-)
+@functools.lru_cache(maxsize=2)
+def _build_context(
+    project_id: str | None, network: Network, base_url: str | None
+) -> ChainQuery:
+    from lib.chain_query import ChainQuery
 
-# Get the script from the Network
-swap_script_hash = swap_address.payment_part
-swap_script = context._get_script(str(swap_script_hash))
+    return ChainQuery(project_id, network, base_url=base_url)
 
-if plutus_script_hash(swap_script) != swap_script_hash:
-    swap_script = PlutusV2Script(cbor2.dumps(swap_script))
 
-# Reading minting script
-with open("./utils/scripts/mint_script.plutus", "r") as f:
-    script_hex = f.read()
-    plutus_script_v2 = PlutusV2Script(cbor2.loads(bytes.fromhex(script_hex)))
+def context() -> ChainQuery:
+    """Chain context used to query and submit transactions, shared per process"""
+    return _build_context(BLOCKFROST_PROJECT_ID, NETWORK_MODE, BLOCKFROST_BASE_URL)
+
+
+# Get the script from the Network
+@functools.cache
+def _swap_script(ctx: ChainQuery) -> PlutusV2Script:
+    swap_script_hash = _addresses()[1].payment_part
+    swap_script = ctx._get_script(str(swap_script_hash))
+
+    if plutus_script_hash(swap_script) != swap_script_hash:
+        swap_script = PlutusV2Script(cbor2.dumps(swap_script))
+    return swap_script
+
+
+# Reading minting script, reusing the decoded bytes cached next to it
+@functools.cache
+def _mint_script() -> PlutusV2Script:
+    mint_script_path = "./utils/scripts/mint_script.plutus"
+    mint_script_cache = mint_script_path + ".bin"
+
+    try:
+        if os.path.getmtime(mint_script_cache) >= os.path.getmtime(mint_script_path):
+            with open(mint_script_cache, "rb") as f:
+                return PlutusV2Script(f.read())
+    except OSError:
+        # Missing or unreadable cache, decode the script source instead
+        pass
+
+    with open(mint_script_path, "r") as f:
+        script_hex = f.read()
+        plutus_script_v2 = PlutusV2Script(cbor2.loads(bytes.fromhex(script_hex)))
+    # Write the cache atomically so a failed write never leaves a truncated script
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=os.path.basename(mint_script_cache) + ".",
+            dir=os.path.dirname(mint_script_cache),
+        )
+    except OSError:
+        return plutus_script_v2
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(bytes(plutus_script_v2))
+        # mkstemp creates the file owner-only, keep the cache readable by others
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, mint_script_cache)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    return plutus_script_v2
+
 
 # User payment key generation
 # node_signing_key = PaymentSigningKey.generate()
@@ -62,241 +118,339 @@ with open("./utils/scripts/mint_script.plutus", "r") as f:
 # extended_payment_vkey = PaymentVerificationKey.load("./credentials/node.vkey")
 #
 # Load user payment key grom wallet file
-extended_payment_skey = w.user_esk()
+@functools.cache
+def _user_skey():
+    return w.user_esk()
+
 
 # User address wallet
-user_address = w.user_address()
+@functools.cache
+def _user_address() -> Address:
+    return w.user_address()
+
 
 # Oracle feed NFT identity
-oracle_nft = MultiAsset.from_primitive(
-    {
-        "8fe2ef24b3cc8882f01d9246479ef6c6fc24a6950b222c206907a8be": {
-            b"InlineOracleFeed": 1
+@functools.cache
+def _oracle_nft() -> MultiAsset:
+    return MultiAsset.from_primitive(
+        {
+            "8fe2ef24b3cc8882f01d9246479ef6c6fc24a6950b222c206907a8be": {
+                b"InlineOracleFeed": 1
+            }
         }
-    }
-)
+    )
+
 
 # Swap NFT identity
-swap_nft = MultiAsset.from_primitive(
-    {"38f143722e0a340027510587d81e49b90904c10fb8271eca13913cd6": {b"SWAP": 1}}
-)
+@functools.cache
+def _swap_nft() -> MultiAsset:
+    return MultiAsset.from_primitive(
+        {"38f143722e0a340027510587d81e49b90904c10fb8271eca13913cd6": {b"SWAP": 1}}
+    )
+
 
 # tUSDT asset information
-tUSDT = MultiAsset.from_primitive(
-    {"c6f192a236596e2bbaac5900d67e9700dec7c77d9da626c98e0ab2ac": {b"USDT": 1}}
-)
+@functools.cache
+def _tusdt() -> MultiAsset:
+    return MultiAsset.from_primitive(
+        {"c6f192a236596e2bbaac5900d67e9700dec7c77d9da626c98e0ab2ac": {b"USDT": 1}}
+    )
+
 
 # swap instance
-swap = Swap(swap_nft, tUSDT)
+@functools.cache
+def _swap() -> Swap:
+    return Swap(_swap_nft(), _tusdt())
+
 
 # ---------------------      -- #
 #         Parser Section        #
 # -----------------------       #
 
-parser = argparse.ArgumentParser(
-    prog="python main.py",
-    description="The swap python script is a demonstrative smart contract "   \
-    "(Plutus v2) featuring the interaction with a Charli3's oracle. This "    \
-    "script uses the inline oracle feed as reference input simulating the "   \
-    "exchange rate between tADA and tUSDT to sell or buy assets from a swap " \
-    "contract in the test environment of preproduction. ",
-    epilog="Copyrigth: (c) 2020 - 2023 Charli3",
-)
+@functools.cache
+def create_parser() -> argparse.ArgumentParser:
+    """Build the command-line parser of the swap script"""
+    parser = argparse.ArgumentParser(
+        prog="python main.py",
+        description="The swap python script is a demonstrative smart contract "   \
+        "(Plutus v2) featuring the interaction with a Charli3's oracle. This "    \
+        "script uses the inline oracle feed as reference input simulating the "   \
+        "exchange rate between tADA and tUSDT to sell or buy assets from a swap " \
+        "contract in the test environment of preproduction. ",
+        epilog="Copyrigth: (c) 2020 - 2023 Charli3",
+    )
 
-# Create a subparser for each main choice
-subparsers = parser.add_subparsers(dest="subparser_main_name")
+    # Create a subparser for each main choice
+    subparsers = parser.add_subparsers(dest="subparser_main_name")
 
-# Create a parser for the "trade" choice
-trade_parser = subparsers.add_parser(
-    "trade",
-    help="Call the trade transaction to exchange a user asset with another " \
-    "asset at the swap contract. Supported assets tADA and tUSDT.",
-    description="Trade transaction to sell and buy tUSDT or tADA.",
-)
+    # Create a parser for the "trade" choice
+    trade_parser = subparsers.add_parser(
+        "trade",
+        help="Call the trade transaction to exchange a user asset with another " \
+        "asset at the swap contract. Supported assets tADA and tUSDT.",
+        description="Trade transaction to sell and buy tUSDT or tADA.",
+    )
 
-# Create a subparser for each trade option
-sub_sub = trade_parser.add_subparsers(dest="subparser_trade_name")
+    # Create a subparser for each trade option
+    sub_sub = trade_parser.add_subparsers(dest="subparser_trade_name")
 
-sub_trade_parser = sub_sub.add_parser("tADA", help="Toy ADA asset.")
-sub_trade_parser.add_argument(
-    "--amount",
-    type=int,
-    default=0,
-    metavar="tLOVELACE",
-    help="Amount of lovelace to trade.",
-)
+    sub_trade_parser = sub_sub.add_parser("tADA", help="Toy ADA asset.")
+    sub_trade_parser.add_argument(
+        "--amount",
+        type=int,
+        default=0,
+        metavar="tLOVELACE",
+        help="Amount of lovelace to trade.",
+    )
 
-sub_trade_parser = sub_sub.add_parser("tUSDT", help="Toy USDT asset.")
-sub_trade_parser.add_argument(
-    "--amount",
-    type=int,
-    default=0,
-    metavar="tUSDT",
-    help="Amount of tUSDT to trade.",
-)
+    sub_trade_parser = sub_sub.add_parser("tUSDT", help="Toy USDT asset.")
+    sub_trade_parser.add_argument(
+        "--amount",
+        type=int,
+        default=0,
+        metavar="tUSDT",
+        help="Amount of tUSDT to trade.",
+    )
 
-# Create a parser for the "user" choice
-user_parser = subparsers.add_parser(
-    "user",
-    help="Obtain information about the wallet of the user who participate in "\
-    "the trade transaction.",
-    description="User wallet information.",
-)
-user_parser.add_argument(
-    "--liquidity",
-    action="store_true",
-    help="Print the amount of availables assets.",
-)
+    # Create a parser for the "user" choice
+    user_parser = subparsers.add_parser(
+        "user",
+        help="Obtain information about the wallet of the user who participate in "\
+        "the trade transaction.",
+        description="User wallet information.",
+    )
+    user_parser.add_argument(
+        "--liquidity",
+        action="store_true",
+        help="Print the amount of availables assets.",
+    )
 
-user_parser.add_argument(
-    "--address",
-    action="store_true",
-    help="Print the wallet address.",
-)
-# Create a parser for the "swap-contract" choice
-swap_parser = subparsers.add_parser(
-    "swap-contract",
-    help="Obtain information about the SWAP smart contract.",
-    description="SWAP smart contract information.",
-)
-swap_parser.add_argument(
-    "--liquidity",
-    action="store_true",
-    help="Print the amount of availables assets.",
-)
+    user_parser.add_argument(
+        "--address",
+        action="store_true",
+        help="Print the wallet address.",
+    )
+    # Create a parser for the "swap-contract" choice
+    swap_parser = subparsers.add_parser(
+        "swap-contract",
+        help="Obtain information about the SWAP smart contract.",
+        description="SWAP smart contract information.",
+    )
+    swap_parser.add_argument(
+        "--liquidity",
+        action="store_true",
+        help="Print the amount of availables assets.",
+    )
 
-swap_parser.add_argument(
-    "--address",
-    action="store_true",
-    help="Print the swap contract address.",
-)
+    swap_parser.add_argument(
+        "--address",
+        action="store_true",
+        help="Print the swap contract address.",
+    )
 
-swap_parser.add_argument(
-    "--add-liquidity",
-    nargs=2,
-    action="store",
-    dest="addliquidity",
-    metavar=("tUSDT", "tADA"),
-    type=int,
-    help="Add asset liquidity at swap UTXO.",
-)
+    swap_parser.add_argument(
+        "--add-liquidity",
+        nargs=2,
+        action="store",
+        dest="addliquidity",
+        metavar=("tUSDT", "tADA"),
+        type=int,
+        help="Add asset liquidity at swap UTXO.",
+    )
 
-swap_parser.add_argument(
-    "--start-swap",
-    dest="soracle",
-    action="store_true",
-    help="Generate a UTXO and mint an NFT at the specified swap contract address.",
-)
-# Create a parser for the "oracle-contract" choice
-oracle_parser = subparsers.add_parser(
-    "oracle-contract",
-    help="Obtain information about the ORACLE smart contract.",
-    description="ORACLE smart contract information.",
-)
-oracle_parser.add_argument(
-    "--feed",
-    action="store_true",
-    help="Print the oracle feed (exchange rate) tUSDT/tADA.",
-)
+    swap_parser.add_argument(
+        "--start-swap",
+        dest="soracle",
+        action="store_true",
+        help="Generate a UTXO and mint an NFT at the specified swap contract address.",
+    )
+    # Create a parser for the "oracle-contract" choice
+    oracle_parser = subparsers.add_parser(
+        "oracle-contract",
+        help="Obtain information about the ORACLE smart contract.",
+        description="ORACLE smart contract information.",
+    )
+    oracle_parser.add_argument(
+        "--feed",
+        action="store_true",
+        help="Print the oracle feed (exchange rate) tUSDT/tADA.",
+    )
 
-oracle_parser.add_argument(
-    "--address",
-    action="store_true",
-    help="Print the oracle contract address.",
-)
+    oracle_parser.add_argument(
+        "--address",
+        action="store_true",
+        help="Print the oracle contract address.",
+    )
+
+    return parser
+
+
+# Swap contract instance, shared by the operations using the same chain context
+@functools.cache
+def _swap_contract(ctx: ChainQuery) -> SwapContract:
+    oracle_address, swap_address = _addresses()
+    return SwapContract(ctx, _oracle_nft(), oracle_address, swap_address, _swap())
 
-# Parser command-line arguments
-args = parser.parse_args()
 
-if args.subparser_main_name == "trade" and args.subparser_trade_name == "tADA":
-    swapInstance = SwapContract(context,
-                                oracle_nft,
-                                oracle_address,
-                                swap_address,
-                                swap)
+def _fmt_ts(timestamp: int) -> str:
+    """Format a POSIX timestamp as a UTC date"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(timestamp))
+
+
+def _fmt_ada(tlovelace: int) -> str:
+    """Format a lovelace amount as tADA, keeping the exact tlovelace"""
+    tada, _ = divmod(tlovelace, 1_000_000)
+    return f"{tada} tADA ({tlovelace} tlovelace)"
+
+
+def _do_trade_tada(args: argparse.Namespace, ctx: ChainQuery | None) -> None:
+    swapInstance = _swap_contract(ctx)
     swapInstance.swap_B(
         args.amount,
-        user_address,
-        swap_address,
-        swap_script,
-        extended_payment_skey,
+        _user_address(),
+        swapInstance.swap_addr,
+        _swap_script(ctx),
+        _user_skey(),
     )
 
-elif args.subparser_main_name == "trade" and args.subparser_trade_name == "tUSDT":
-    swapInstance = SwapContract(context,
-                                oracle_nft,
-                                oracle_address,
-                                swap_address,
-                                swap)
+
+def _do_trade_tusdt(args: argparse.Namespace, ctx: ChainQuery | None) -> None:
+    swapInstance = _swap_contract(ctx)
     swapInstance.swap_A(
         args.amount,
-        user_address,
-        swap_address,
-        swap_script,
-        extended_payment_skey,
+        _user_address(),
+        swapInstance.swap_addr,
+        _swap_script(ctx),
+        _user_skey(),
     )
 
-elif args.subparser_main_name == "user" and args.liquidity:
-    swapInstance = SwapContract(context,
-                                oracle_nft,
-                                oracle_address,
-                                swap_address,
-                                swap)
-    tlovelace = swapInstance.available_user_tlovelace(user_address)
-    tUSDT = swapInstance.available_user_tusdt(user_address)
+
+def _do_user_liquidity(args: argparse.Namespace, ctx: ChainQuery | None) -> None:
+    swapInstance = _swap_contract(ctx)
+    _, tlovelace, tUSDT = swapInstance.snapshot(_user_address())
     print(
         f"""User wallet's liquidity:
-    * {tlovelace // 1000000} tADA ({tlovelace} tlovelace).
+    * {_fmt_ada(tlovelace)}.
     * {tUSDT} tUSDT."""
     )
-elif args.subparser_main_name == "user" and args.address:
-    print(f"User's wallet address (Mnemonic): {w.user_address()}")
-elif args.subparser_main_name == "swap-contract" and args.liquidity:
-    swapInstance = SwapContract(context, oracle_nft, oracle_address,
-                                swap_address,
-                                swap)
-    tlovelace = swapInstance.get_swap_utxo().output.amount.coin
-    tUSDT = swapInstance.add_asset_swap_amount(0)
+
+
+def _do_user_address(args: argparse.Namespace, ctx: ChainQuery | None) -> None:
+    print(f"User's wallet address (Mnemonic): {_user_address()}")
+
+
+def _do_swap_liquidity(args: argparse.Namespace, ctx: ChainQuery | None) -> None:
+    swapInstance = _swap_contract(ctx)
+    swap_utxo = swapInstance.get_swap_utxo()
+    tlovelace = swap_utxo.output.amount.coin
+    tUSDT = swapInstance.asset_amount(swap_utxo.output.amount.multi_asset)
     print(
         f"""Swap contract liquidity:
-    * {tlovelace // 1000000} tADA ({tlovelace} tlovelace).
+    * {_fmt_ada(tlovelace)}.
     * {tUSDT} tUSDT."""
     )
-elif args.subparser_main_name == "swap-contract" and args.address:
-    print(f"Swap contract's address: {swap_address}")
-elif args.subparser_main_name == "swap-contract" and args.addliquidity:
-    swapInstance = SwapContract(context, oracle_nft, oracle_address,
-                                swap_address, swap)
+
+
+def _do_swap_address(args: argparse.Namespace, ctx: ChainQuery | None) -> None:
+    print(f"Swap contract's address: {_addresses()[1]}")
+
+
+def _do_swap_add_liquidity(args: argparse.Namespace, ctx: ChainQuery | None) -> None:
+    swapInstance = _swap_contract(ctx)
     swapInstance.add_liquidity(
         args.addliquidity[0],
         args.addliquidity[1],
-        user_address,
-        swap_address,
-        swap_script,
-        extended_payment_skey,
+        _user_address(),
+        swapInstance.swap_addr,
+        _swap_script(ctx),
+        _user_skey(),
     )
-elif args.subparser_main_name == "swap-contract" and args.soracle:
+
+
+def _do_swap_start(args: argparse.Namespace, ctx: ChainQuery | None) -> None:
+    from mint import Mint
+
     swap_utxo_nft = Mint(
-        context, extended_payment_skey, user_address, swap_address,
-        plutus_script_v2
+        ctx, _user_skey(), _user_address(), _addresses()[1],
+        _mint_script()
     )
     swap_utxo_nft.mint_nft_with_script()
+    invalidate_utxo_cache()
 
-elif args.subparser_main_name == "oracle-contract" and args.feed:
-    swapInstance = SwapContract(context, oracle_nft, oracle_address,
-                                swap_address,
-                                swap)
-    exchange = swapInstance.get_oracle_exchange_rate()
-    generated_time = datetime.utcfromtimestamp(
-        swapInstance.get_oracle_timestamp()
-    ).strftime("%Y-%m-%d %H:%M:%S")
-    expiration_time = datetime.utcfromtimestamp(
-        swapInstance.get_oracle_expiration()
-    ).strftime("%Y-%m-%d %H:%M:%S")
+
+def _do_oracle_feed(args: argparse.Namespace, ctx: ChainQuery | None) -> None:
+    swapInstance = _swap_contract(ctx)
+    exchange, timestamp, expiration = swapInstance.get_oracle_feed()
+    generated_time = _fmt_ts(timestamp)
+    expiration_time = _fmt_ts(expiration)
     print(
         f"Oracle feed:\n* Exchange rate tADA/tUSDt {exchange/1000000}\n* " \
-        "Generated data at: {generated_time}\n* Expiration data " \
-        "at: {expiration_time}"
+        f"Generated data at: {generated_time}\n* Expiration data " \
+        f"at: {expiration_time}"
     )
-elif args.subparser_main_name == "oracle-contract" and args.address:
-    print(f"Oracle contract's address: {oracle_address}")
+
+
+def _do_oracle_address(args: argparse.Namespace, ctx: ChainQuery | None) -> None:
+    print(f"Oracle contract's address: {_addresses()[0]}")
+
+
+# Operation handlers by (command, action)
+DISPATCH = {
+    ("trade", "tADA"): _do_trade_tada,
+    ("trade", "tUSDT"): _do_trade_tusdt,
+    ("user", "liquidity"): _do_user_liquidity,
+    ("user", "address"): _do_user_address,
+    ("swap-contract", "liquidity"): _do_swap_liquidity,
+    ("swap-contract", "address"): _do_swap_address,
+    ("swap-contract", "addliquidity"): _do_swap_add_liquidity,
+    ("swap-contract", "soracle"): _do_swap_start,
+    ("oracle-contract", "feed"): _do_oracle_feed,
+    ("oracle-contract", "address"): _do_oracle_address,
+}
+
+# Command flags in order of precedence when several are given
+_ACTIONS = {
+    "user": ("liquidity", "address"),
+    "swap-contract": ("liquidity", "address", "addliquidity", "soracle"),
+    "oracle-contract": ("feed", "address"),
+}
+
+# Operations that don't query the chain
+_CHAIN_FREE = {
+    ("user", "address"),
+    ("swap-contract", "address"),
+    ("oracle-contract", "address"),
+}
+
+
+def _action_of(args: argparse.Namespace) -> str | None:
+    """Operation selected for the command line's main choice"""
+    if args.subparser_main_name == "trade":
+        return args.subparser_trade_name
+    for action in _ACTIONS.get(args.subparser_main_name, ()):
+        if getattr(args, action):
+            return action
+    return None
+
+
+def display(args: argparse.Namespace, ctx: ChainQuery | None) -> None:
+    """Run the operation selected in the command line"""
+    handler = DISPATCH.get((args.subparser_main_name, _action_of(args)))
+    if handler is not None:
+        handler(args, ctx)
+
+
+def _needs_chain(args: argparse.Namespace) -> bool:
+    """Whether the selected operation queries or submits to the chain"""
+    key = (args.subparser_main_name, _action_of(args))
+    return key in DISPATCH and key not in _CHAIN_FREE
+
+
+def main() -> None:
+    # Without a command there is nothing to run, show the help instead
+    args = create_parser().parse_args(None if sys.argv[1:] else ["-h"])
+    display(args, context() if _needs_chain(args) else None)
+
+
+if __name__ == "__main__":
+    main()
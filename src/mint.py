@@ -1,5 +1,8 @@
 """offchain code containing mint class"""
+from __future__ import annotations
+
 from dataclasses import dataclass
+from typing import TYPE_CHECKING
 from pycardano import (
     Address,
     PaymentVerificationKey,
@@ -19,7 +22,9 @@ from pycardano import (
     ExecutionUnits,
     utils,
 )
-from lib.chain_query import ChainQuery
+
+if TYPE_CHECKING:
+    from lib.chain_query import ChainQuery
 
 
 @dataclass
@@ -1,9 +1,37 @@
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, Any, Callable
+
 import pycardano as pyc
-from lib.chain_query import ChainQuery
 
-from lib.datums import GenericData, Nothing
+from lib.datums import GenericData, Nothing, PriceData
 from lib.redeemers import AddLiquidity, SwapA, SwapB
 
+if TYPE_CHECKING:
+    from lib.chain_query import ChainQuery
+
+# Seconds a contract address query is reused before querying the chain again
+UTXO_CACHE_TTL = 15
+
+_utxo_cache: dict[str, tuple[float, Any]] = {}
+
+
+def _cached(fn: Callable[[], Any], key: str) -> Any:
+    """Return the result of fn stored under key while it is fresher than the TTL"""
+    now = time.monotonic()
+    entry = _utxo_cache.get(key)
+    if entry is not None and now - entry[0] < UTXO_CACHE_TTL:
+        return entry[1]
+    value = fn()
+    _utxo_cache[key] = (now, value)
+    return value
+
+
+def invalidate_utxo_cache() -> None:
+    """Discard the cached contract UTxOs, e.g. after submitting a transaction"""
+    _utxo_cache.clear()
+
 
 class Swap:
     """Class Swap for interact with the assets in the swap operation
@@ -12,6 +40,8 @@ class Swap:
     Attribures:
         swap_nft: The NFT identifier of the swap utxo
         coinA: Asset
+        coinA_policy_id: Policy ID of coinA
+        coinA_name: Asset name of coinA
     """
 
     def __init__(
@@ -21,6 +51,8 @@ class Swap:
     ) -> None:
         self.swap_nft = swap_nft
         self.coinA = coinA
+        ((self.coinA_policy_id, assets),) = coinA.to_shallow_primitive().items()
+        ((self.coinA_name, _),) = assets.to_shallow_primitive().items()
 
 
 class SwapContract:
@@ -57,7 +89,8 @@ class SwapContract:
         script: bytes,
         sk: pyc.PaymentSigningKey,
     ):
-
+        # Build the transaction on the UTxOs currently at the contract
+        invalidate_utxo_cache()
         swap_utxo = self.get_swap_utxo()
         available_user_tADA = self.available_user_tlovelace(user_address) // 1000000
         available_user_tUSDT = self.available_user_tusdt(user_address)
@@ -111,6 +144,8 @@ class SwapContract:
         sk: pyc.PaymentSigningKey,
     ):
         """Exchange of asset A  with B"""
+        # Build the transaction on the UTxOs currently at the contract
+        invalidate_utxo_cache()
         oracle_feed_utxo = self.get_oracle_utxo()
         swap_utxo = self.get_swap_utxo()
         amountB = self.swap_a_with_b(amountA)
@@ -188,6 +223,8 @@ class SwapContract:
         sk: pyc.PaymentSigningKey,
     ):
         """Exchange of asset B  with A"""
+        # Build the transaction on the UTxOs currently at the contract
+        invalidate_utxo_cache()
         oracle_feed_utxo = self.get_oracle_utxo()
         swap_utxo = self.get_swap_utxo()
         amountA = self.swap_b_with_a(amountB)
@@ -288,31 +325,39 @@ class SwapContract:
 
     def get_oracle_exchange_rate(self) -> int:
         """Get the oracle's feed exchange rate"""
-        oracle_feed_utxo = self.get_oracle_utxo()
-        oracle_inline_datum: GenericData = GenericData.from_cbor(
-            oracle_feed_utxo.output.datum.cbor
-        )
-        return oracle_inline_datum.price_data.get_price()
+        return self._oracle_price_data().get_price()
 
     def get_oracle_timestamp(self) -> int:
         """Get the oracle's feed exchange rate"""
-        oracle_feed_utxo = self.get_oracle_utxo()
-        oracle_inline_datum: GenericData = GenericData.from_cbor(
-            oracle_feed_utxo.output.datum.cbor
-        )
-        return oracle_inline_datum.price_data.get_timestamp()
+        return self._oracle_price_data().get_timestamp()
 
     def get_oracle_expiration(self) -> int:
         """Get the oracle's feed exchange rate"""
+        return self._oracle_price_data().get_expiry()
+
+    def get_oracle_feed(self) -> tuple[int, int, int]:
+        """Get the oracle's feed exchange rate, timestamp and expiration
+        decoding the inline datum once"""
+        price_data = self._oracle_price_data()
+        return (
+            price_data.get_price(),
+            price_data.get_timestamp(),
+            price_data.get_expiry(),
+        )
+
+    def _oracle_price_data(self) -> PriceData:
+        """Decode the price data of the oracle's feed inline datum"""
         oracle_feed_utxo = self.get_oracle_utxo()
         oracle_inline_datum: GenericData = GenericData.from_cbor(
             oracle_feed_utxo.output.datum.cbor
         )
-        return oracle_inline_datum.price_data.get_expiry()
+        return oracle_inline_datum.price_data
 
     def get_oracle_utxo(self) -> pyc.UTxO:
         """Retrieve the oracle's feed UTXO using the NFT identifier."""
-        oracle_utxos = self.context.utxos(str(self.oracle_addr))
+        oracle_utxos = _cached(
+            lambda: self.context.utxos(str(self.oracle_addr)), str(self.oracle_addr)
+        )
         oracle_utxo_nft = next(
             utxo
             for utxo in oracle_utxos
@@ -322,7 +367,9 @@ class SwapContract:
 
     def get_swap_utxo(self) -> pyc.UTxO:
         """Retrieve the UTxO for the swap using the NFT identifier"""
-        swap_utxos = self.context.utxos(str(self.swap_addr))
+        swap_utxos = _cached(
+            lambda: self.context.utxos(str(self.swap_addr)), str(self.swap_addr)
+        )
         swap_utxo_nft = next(
             x for x in swap_utxos if x.output.amount.multi_asset >= self.swap.swap_nft
         )
@@ -330,8 +377,7 @@ class SwapContract:
 
     def decrease_asset_swap(self, selling_amount: int) -> pyc.MultiAsset:
         """The updated swap asset to be decreased at the address"""
-        ((policy_id, assets),) = self.swap.coinA.to_shallow_primitive().items()
-        ((asset, _),) = assets.to_shallow_primitive().items()
+        policy_id, asset = self.swap.coinA_policy_id, self.swap.coinA_name
 
         swap_utxo = self.get_swap_utxo()
         m_assets = swap_utxo.output.amount.multi_asset.to_shallow_primitive()
@@ -352,8 +398,7 @@ class SwapContract:
 
     def decrease_asset_swap_amount(self, selling_amount: int) -> int:
         """The updated swap asset amount to be decreased at the address"""
-        ((policy_id, assets),) = self.swap.coinA.to_shallow_primitive().items()
-        ((asset, _),) = assets.to_shallow_primitive().items()
+        policy_id, asset = self.swap.coinA_policy_id, self.swap.coinA_name
 
         swap_utxo = self.get_swap_utxo()
         m_assets = swap_utxo.output.amount.multi_asset.to_shallow_primitive()
@@ -368,8 +413,7 @@ class SwapContract:
 
     def add_asset_swap(self, buying_amount: int) -> pyc.MultiAsset:
         """The updated swap asset to be added at the address"""
-        ((policy_id, assets),) = self.swap.coinA.to_shallow_primitive().items()
-        ((asset, _),) = assets.to_shallow_primitive().items()
+        policy_id, asset = self.swap.coinA_policy_id, self.swap.coinA_name
 
         swap_utxo = self.get_swap_utxo()
         m_assets = swap_utxo.output.amount.multi_asset.to_shallow_primitive()
@@ -390,8 +434,7 @@ class SwapContract:
 
     def add_asset_swap_amount(self, buying_amount: int) -> int:
         """The updated swap asset amount to be added at the address"""
-        ((policy_id, assets),) = self.swap.coinA.to_shallow_primitive().items()
-        ((asset, _),) = assets.to_shallow_primitive().items()
+        policy_id, asset = self.swap.coinA_policy_id, self.swap.coinA_name
 
         swap_utxo = self.get_swap_utxo()
         m_assets = swap_utxo.output.amount.multi_asset.to_shallow_primitive()
@@ -406,8 +449,7 @@ class SwapContract:
 
     def take_multi_asset_user(self, buying_amount: int) -> pyc.MultiAsset:
         """The updated user asset to be added to it's wallet"""
-        ((policy_id, assets),) = self.swap.coinA.to_shallow_primitive().items()
-        ((asset, _),) = assets.to_shallow_primitive().items()
+        policy_id, asset = self.swap.coinA_policy_id, self.swap.coinA_name
 
         swap_utxo = self.get_swap_utxo()
         m_assets = swap_utxo.output.amount.multi_asset.to_shallow_primitive()
@@ -439,18 +481,33 @@ class SwapContract:
 
     def available_user_tusdt(self, user_address: pyc.Address) -> int:
         amount_asset = 0
-        ((policy_id, assets),) = self.swap.coinA.to_shallow_primitive().items()
-        ((asset, _),) = assets.to_shallow_primitive().items()
-
         for utxo in self.context.utxos(str(user_address)):
-            m_assets = utxo.output.amount.multi_asset.to_shallow_primitive()
-            for user_policy_id, assets in m_assets.items():
-                if user_policy_id == policy_id:
-                    for asset_name, amount in assets.items():
-                        if asset_name == asset:
-                            amount_asset += amount
+            amount_asset += self.asset_amount(utxo.output.amount.multi_asset)
         return amount_asset
 
+    def asset_amount(self, multi_asset: pyc.MultiAsset) -> int:
+        """Get the amount of the swap asset (coin A) held in a multi asset"""
+        policy_id, asset = self.swap.coinA_policy_id, self.swap.coinA_name
+
+        amount_asset = 0
+        for asset_policy_id, assets in multi_asset.to_shallow_primitive().items():
+            if asset_policy_id == policy_id:
+                for asset_name, amount in assets.items():
+                    if asset_name == asset:
+                        amount_asset += amount
+        return amount_asset
+
+    def snapshot(self, address: pyc.Address) -> tuple[list[pyc.UTxO], int, int]:
+        """Get the UTxOs of an address with its lovelace and tUSDT amounts
+        using a single query"""
+        utxos = self.context.utxos(str(address))
+        amount_lovelace = 0
+        amount_asset = 0
+        for utxo in utxos:
+            amount_lovelace += utxo.output.amount.coin
+            amount_asset += self.asset_amount(utxo.output.amount.multi_asset)
+        return utxos, amount_lovelace, amount_asset
+
     def submit_tx_builder(
         self,
         builder: pyc.TransactionBuilder,
@@ -468,3 +525,4 @@ class SwapContract:
         # print(builder)
         signed_tx = builder.build_and_sign([sk], change_address=address)
         self.context.submit_tx_without_print(signed_tx)
+        invalidate_utxo_cache()
@@ -1,3 +1,4 @@
+import functools
 import os
 from pycardano import (
     HDWallet,
@@ -10,13 +11,21 @@ from pycardano import (
 
 MNEMONIC_24 = os.environ.get("24_WALLET_PASSPHRASE")
 
-def user_address() -> Address:
-    hdwallet = HDWallet.from_mnemonic(MNEMONIC_24)
+
+@functools.lru_cache(maxsize=4)
+def _derive_keys(mnemonic: str) -> tuple[HDWallet, HDWallet]:
+    """Derive the spend and stake HD wallets once per mnemonic"""
+    hdwallet = HDWallet.from_mnemonic(mnemonic)
     hdwallet_spend = hdwallet.derive_from_path("m/1852'/1815'/0'/0/0")
+    hdwallet_stake = hdwallet.derive_from_path("m/1852'/1815'/0'/2/0")
+    return hdwallet_spend, hdwallet_stake
+
+
+def user_address() -> Address:
+    hdwallet_spend, hdwallet_stake = _derive_keys(MNEMONIC_24)
     spend_public_key = hdwallet_spend.public_key
     spend_vk = PaymentVerificationKey.from_primitive(spend_public_key)
 
-    hdwallet_stake = hdwallet.derive_from_path("m/1852'/1815'/0'/2/0")
     stake_public_key = hdwallet_stake.public_key
     stake_vk = PaymentVerificationKey.from_primitive(stake_public_key)
 
@@ -27,18 +36,7 @@ def user_address() -> Address:
 
 
 def user_esk() -> PaymentSigningKey:
-    hdwallet = HDWallet.from_mnemonic(MNEMONIC_24)
-    hdwallet_spend = hdwallet.derive_from_path("m/1852'/1815'/0'/0/0")
-    spend_public_key = hdwallet_spend.public_key
-    spend_vk = PaymentVerificationKey.from_primitive(spend_public_key)
-
-    hdwallet_stake = hdwallet.derive_from_path("m/1852'/1815'/0'/2/0")
-    stake_public_key = hdwallet_stake.public_key
-    stake_vk = PaymentVerificationKey.from_primitive(stake_public_key)
+    hdwallet_spend, _ = _derive_keys(MNEMONIC_24)
 
     extended_signing_key = ExtendedSigningKey.from_hdwallet(hdwallet_spend)
     return extended_signing_key
-
-
-user_address()
-user_esk()